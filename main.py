@@ -1,6 +1,15 @@
-import time
-from collections import defaultdict, deque
+import asyncio
+import uuid
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
 from itertools import islice
+from time import monotonic_ns
+
+try:  # 可选依赖：仅在配置了 redis_url 时使用
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
 
 from astrbot.api import AstrBotConfig, logger
 from astrbot.api.event import filter, AstrMessageEvent
@@ -21,20 +30,19 @@ def _load_limits(raw) -> dict[str, int]:
                 if str(k).strip() and _safe_int(v, 0) > 0}
     if not isinstance(raw, list):
         return {}
-    # 兼容旧版 ["id:count", ...] 格式
+    # 兼容旧版 ["id:count", ...] 格式；ID 本身可能含冒号，按最后一个冒号切分
     result = {}
     for entry in raw:
-        entry = str(entry).strip()
-        if ":" not in entry:
+        key, sep, val = str(entry).rpartition(":")
+        key = key.strip()
+        if not sep or not key:
             continue
-        parts = entry.rsplit(":", 1)
         try:
-            key = parts[0].strip()
-            val = int(parts[1].strip())
-            if key and val > 0:
-                result[key] = val
-        except (ValueError, IndexError):
+            val = int(val.strip())
+        except ValueError:
             continue
+        if val > 0:
+            result[key] = val
     return result
 
 
@@ -57,27 +65,238 @@ def _safe_int(val, default: int) -> int:
         return default
 
 
+class _TipVars(dict):
+    """提示模板变量表，未知占位符原样保留。"""
+
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+def _compile_tip(template: str, fallback: str):
+    """在加载配置时校验提示模板，返回渲染函数 fn(_TipVars) -> str。
+
+    模板无法渲染（如含位置参数或括号不匹配）时记录警告并改用 fallback。
+    """
+    render = template.format_map
+    try:
+        render(_TipVars(cooldown=0.0, max=0, window=0))
+    except (ValueError, IndexError, AttributeError, TypeError, KeyError) as e:
+        logger.warning(f"[rate_limit] 提示模板 '{template}' 无效，使用默认提示: {e}")
+        render = fallback.format_map
+    return render
+
+
+def _cooldown_seconds(cooldown_ms: int) -> float:
+    """毫秒冷却时间换算为秒，向上取整到 0.1 秒（纯整数运算，且不会显示 0 秒）。"""
+    return -(-cooldown_ms // 100) / 10
+
+
+def _now_ms() -> int:
+    """单调时钟的整数毫秒时间戳，不受系统时间回拨影响。"""
+    return monotonic_ns() // 1_000_000
+
 
+class _SlidingWindow:
+    """滑动窗口日志：记录窗口内每次请求的时间戳，精确限制任意窗口内的次数。
+
+    ts 为单调递增的 int64 毫秒时间戳数组（连续存储，无逐元素装箱），
+    ts[head:] 是尚未过期的部分，最多保留最近 max_req 条。
+    """
+    __slots__ = ("ts", "head")
+
+    def __init__(self):
+        self.ts = array("q")
+        self.head = 0
+
+    def _prune(self, window_start: int):
+        """将头指针移过已过期的时间戳，全部过期时清空数组。
+
+        ts 有序，用二分查找定位第一条未过期的时间戳，不在 Python 层逐条比较。
+        """
+        ts = self.ts
+        head = bisect_right(ts, window_start, self.head)
+        if head >= len(ts):
+            del ts[:]
+            head = 0
+        self.head = head
+
+    def check(self, max_req: int, window_ms: int, now: int) -> int:
+        """返回需等待的毫秒数，0 表示允许。"""
+        window_start = now - window_ms
+        self._prune(window_start)
+        ts = self.ts
+        if len(ts) - self.head >= max_req:
+            # 最近 max_req 条中最早的一条过期后即可放行
+            return ts[len(ts) - max_req] - window_start
+        return 0
+
+    def record(self, now: int, max_req: int):
+        """追加一条时间戳，只保留最近 max_req 条；头指针过半时压缩数组。"""
+        ts = self.ts
+        ts.append(now)
+        head = max(self.head, len(ts) - max_req)
+        if head * 2 >= len(ts):
+            del ts[:head]
+            head = 0
+        self.head = head
+
+    def expired(self, window_start: int) -> bool:
+        """窗口内已无有效请求，可以丢弃。"""
+        return len(self.ts) <= self.head or self.ts[-1] <= window_start
+
+    def used(self, max_req: int, window_ms: int, now: int) -> int:
+        """窗口内已用次数（仅用于展示）。"""
+        return len(self.ts) - bisect_right(self.ts, now - window_ms, self.head)
+
+
+class _TokenBucket:
+    """令牌桶：容量 max_req，每 window_ms 毫秒匀速补满，每个 key 只需两个数。
+
+    允许突发 max_req 次，之后按 max_req/window 的速率恢复；
+    与滑动窗口相比不保证任意窗口内严格不超过 max_req 次。
+    """
+    __slots__ = ("tokens", "last")
+
+    def __init__(self):
+        self.tokens: float | None = None  # 首次使用时按容量装满
+        self.last = 0
+
+    def check(self, max_req: int, window_ms: int, now: int) -> int:
+        """补充令牌并返回需等待的毫秒数，0 表示允许。"""
+        tokens = self.tokens
+        if tokens is None:
+            tokens = float(max_req)
+        else:
+            tokens = min(float(max_req), tokens + (now - self.last) * max_req / window_ms)
+        self.tokens = tokens
+        self.last = now
+        if tokens >= 1.0:
+            return 0
+        return max(1, int((1.0 - tokens) * window_ms / max_req))
+
+    def record(self, now: int, max_req: int):
+        """消耗一个令牌；未经 check 的新建状态视为满桶。"""
+        if self.tokens is None:
+            self.tokens = float(max_req)
+            self.last = now
+        self.tokens -= 1.0
+
+    def expired(self, window_start: int) -> bool:
+        """一个窗口内无请求时令牌必然已补满，等同于新建状态。"""
+        return self.last <= window_start
+
+    def used(self, max_req: int, window_ms: int, now: int) -> int:
+        """当前已消耗的令牌数（仅用于展示）。"""
+        if self.tokens is None:
+            return 0
+        tokens = min(float(max_req), self.tokens + (now - self.last) * max_req / window_ms)
+        return int(max_req - tokens)
+
+
+_ALGORITHMS = {
+    "sliding_window": _SlidingWindow,
+    "token_bucket": _TokenBucket,
+}
+
+
+# Redis 滑动窗口脚本：原子地完成用户级 + 群总量两项检查，都通过后才记录。
+# KEYS[1]=用户 key, KEYS[2]=群组 key
+# ARGV[1]=窗口毫秒数, ARGV[2]=用户上限(0=不检查), ARGV[3]=群上限(0=不检查), ARGV[4]=本次请求唯一成员
+# 返回 {0, 0} 放行；{1, 冷却毫秒} 用户超限；{2, 冷却毫秒} 群总量超限。
+# 使用 Redis 服务器时间，多进程/多主机之间无需时钟一致。
+_REDIS_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local win = tonumber(ARGV[1])
+local start = now - win
+local limits = {tonumber(ARGV[2]), tonumber(ARGV[3])}
+for i = 1, 2 do
+  local max = limits[i]
+  if max > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', start)
+    if redis.call('ZCARD', KEYS[i]) >= max then
+      local ts = redis.call('ZRANGE', KEYS[i], -max, -max, 'WITHSCORES')
+      return {i, tonumber(ts[2]) - start}
+    end
+  end
+end
+for i = 1, 2 do
+  if limits[i] > 0 then
+    redis.call('ZADD', KEYS[i], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[i], win)
+  end
+end
+return {0, 0}
+"""
+_REDIS_PREFIX = "astrbot_rate_limit"
+
+_MISSING = object()  # _user_policy 查询未命中的哨兵
 
 
 class RateLimitPlugin(Star):
     _CLEANUP_INTERVAL = 300  # 自动清理间隔（秒）
-    _CLEANUP_BATCH = 200     # 单次清理最多处理的 key 数
+    _CLEANUP_BATCH = 2048    # 单次清理最多处理的 key 数
+    _SWEEP_EVERY = 1024      # 每累计多少次 LLM 请求强制清理一轮
     _MAX_DISPLAY = 30        # 列表命令最大显示条数
+    _SAVE_DELAY = 0.5        # 配置保存防抖延迟（秒）
+    _MAX_TRACKED = 100_000   # 每张状态表最多跟踪的 key 数
+    _REDIS_TIMEOUT = 0.5     # Redis 连接与读写超时（秒）
+    _REDIS_BACKOFF = 30      # Redis 出错后暂停使用、退回内存检查的时长（秒）
 
     def __init__(self, context: Context, config: AstrBotConfig):
         super().__init__(context)
         self.config = config
+        # 用户级限流状态: user_id -> _SlidingWindow | _TokenBucket（首次记录时才创建，按最近记录排序）
+        self._request_records: OrderedDict[str, _SlidingWindow | _TokenBucket] = OrderedDict()
+        # 群组级限流状态: group_id -> _SlidingWindow | _TokenBucket（首次记录时才创建，按最近记录排序）
+        self._group_records: OrderedDict[str, _SlidingWindow | _TokenBucket] = OrderedDict()
         self._reload_config()
-
-        # 用户级滑动窗口: user_id -> deque[timestamp]
-        self._request_records: dict[str, deque[float]] = defaultdict(deque)
-        # 群组级滑动窗口: group_id -> deque[timestamp]
-        self._group_records: dict[str, deque[float]] = defaultdict(deque)
-        # 上次自动清理时间
-        self._last_cleanup: float = time.monotonic()
-        # 清理游标：在多轮清理中轮转遍历所有 key
-        self._cleanup_cursor: int = 0
+        # 多进程部署时可选的共享状态（Redis），未配置时为 None
+        self._redis = None
+        self._redis_script = None
+        # Redis 出错后在此时刻（毫秒）之前不再尝试，0 表示 Redis 正常
+        self._redis_retry_at: int = 0
+        self._init_redis(str(self.config.get("redis_url") or "").strip())
+
+        # 上次自动清理时间（毫秒）
+        self._last_cleanup: int = _now_ms()
+        # 距上次清理的请求计数，高频新用户场景下按请求数触发清理
+        self._sweep_counter: int = 0
+        # 因达到 _MAX_TRACKED 而被淘汰的 key 数
+        self._evicted: int = 0
+        # 延迟保存：短时间内的多次配置修改合并为一次写盘
+        self._save_pending: bool = False
+        self._save_task: asyncio.Task | None = None
+        # 正在工作线程中执行的写盘（线程无法取消，卸载时需等待其完成）
+        self._write_task: asyncio.Future | None = None
+        # 最近一次保存失败的原因，保存成功后清空
+        self._save_error: str | None = None
+
+    def _init_redis(self, url: str):
+        """配置了 redis_url 时创建 Redis 客户端并注册限流脚本。"""
+        if not url:
+            return
+        if aioredis is None:
+            logger.warning("[rate_limit] 已配置 redis_url 但未安装 redis 库，使用内存存储")
+            return
+        try:
+            # 超时要短：Redis 无响应时每个请求都会在这里等待
+            self._redis = aioredis.Redis.from_url(
+                url,
+                socket_connect_timeout=self._REDIS_TIMEOUT,
+                socket_timeout=self._REDIS_TIMEOUT,
+            )
+            self._redis_script = self._redis.register_script(_REDIS_SCRIPT)
+        except Exception as e:
+            self._redis = self._redis_script = None
+            logger.warning(f"[rate_limit] 初始化 Redis 失败，使用内存存储: {e}")
+            return
+        if self.algorithm != "sliding_window":
+            # Redis 退避期间的内存检查也用滑动窗口，避免 Redis 抖动时限流语义来回切换
+            logger.info("[rate_limit] Redis 存储仅支持滑动窗口算法，algorithm 配置不生效")
+            self.algorithm = "sliding_window"
+            self._window_cls = _SlidingWindow
 
     def _reload_config(self):
         """从配置对象加载/重新加载所有参数。"""
@@ -85,6 +304,13 @@ class RateLimitPlugin(Star):
         self.enable_group_total_limit: bool = _safe_bool(self.config.get("enable_group_total_limit", True), True)
         self.max_requests: int = max(1, _safe_int(self.config.get("max_requests", 6), 6))
         self.time_window: int = max(1, _safe_int(self.config.get("time_window_seconds", 60), 60))
+        self._time_window_ms: int = self.time_window * 1000
+        algorithm = str(self.config.get("algorithm") or "sliding_window").strip()
+        if algorithm not in _ALGORITHMS:
+            logger.warning(f"[rate_limit] 未知的限流算法 '{algorithm}'，使用 sliding_window")
+            algorithm = "sliding_window"
+        self.algorithm: str = algorithm
+        self._window_cls = _ALGORITHMS[algorithm]
         self.default_group_total: int = max(0, _safe_int(self.config.get("default_group_total", 0), 0))
         # 白名单 ID 统一转 str 并去重
         self.whitelist: set[str] = {str(x).strip() for x in (self.config.get("whitelist") or []) if str(x).strip()}
@@ -95,183 +321,346 @@ class RateLimitPlugin(Star):
             "⚠️ 请求过于频繁，请在 {cooldown} 秒后再试。（限制：{window} 秒内最多 {max} 次）"
         self.group_tip_message: str = self.config.get("group_tip_message") or \
             "⚠️ 本群请求过于频繁，请在 {cooldown} 秒后再试。（群限制：{window} 秒内合计最多 {max} 次）"
+        self._render_tip = _compile_tip(self.tip_message, "⚠️ 请求过于频繁，请稍后再试。")
+        self._render_group_tip = _compile_tip(self.group_tip_message, "⚠️ 本群请求过于频繁，请稍后再试。")
         logger.debug(f"[rate_limit] 配置已加载: 用户限制={self.enable_user_limit}, "
                      f"群总量限制={self.enable_group_total_limit}, "
+                     f"算法={self.algorithm}, "
                      f"每用户={self.max_requests}/{self.time_window}s, "
                      f"群默认总量={self.default_group_total}")
+        self._on_limits_changed()
+
+    def _on_limits_changed(self):
+        """限制或白名单变更后刷新派生状态并重建检查函数。"""
+        # 用户策略表: user_id -> 自定义次数，白名单用户为 None（白名单优先）
+        self._user_policy: dict[str, int | None] = dict(self.user_limits)
+        self._user_policy.update(dict.fromkeys(self.whitelist))
+        # 群总量限制开启但默认值为 0 且没有单独配置时，实际不会限制任何群
+        self._group_total_active: bool = self.enable_group_total_limit and \
+            (self.default_group_total > 0 or bool(self.group_total_limits))
+        self._any_limit_enabled: bool = self.enable_user_limit or self._group_total_active
+        # 只有群总量限制或群组每用户限制会用到群号
+        self._need_group_id: bool = self._group_total_active or \
+            (self.enable_user_limit and bool(self.group_limits))
+        self._check_fn = self._build_checker()
 
     def _save_limits(self):
-        """将所有限制字典直接保存到配置。保存失败时回滚内存状态。"""
-        backup = (
-            self.config.get("group_limits"),
-            self.config.get("group_total_limits"),
-            self.config.get("user_limits"),
-        )
+        """将所有限制字典写回配置，并安排延迟保存。"""
         self.config["group_limits"] = dict(self.group_limits)
         self.config["group_total_limits"] = dict(self.group_total_limits)
         self.config["user_limits"] = dict(self.user_limits)
+        self._schedule_save()
+
+    def _schedule_save(self):
+        """标记配置待保存；若没有进行中的保存任务则创建一个。"""
+        self._save_pending = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._delayed_save())
+
+    async def _delayed_save(self):
+        """防抖后在工作线程中写盘，避免阻塞事件循环。
+
+        写盘期间若又有修改，会在下一轮循环中再保存一次。
+        """
+        while self._save_pending:
+            await asyncio.sleep(self._SAVE_DELAY)
+            await self._write_config()
+
+    async def _write_config(self):
+        """在工作线程中保存一次配置。
+
+        写盘用 shield 保护：取消本协程不会让线程中的写入与下一次写入并发。
+        失败时不回滚，修改仍在内存和配置对象中生效，但重启后会丢失。
+        """
+        self._save_pending = False
+        self._write_task = asyncio.ensure_future(asyncio.to_thread(self.config.save_config))
         try:
-            self.config.save_config()
+            await asyncio.shield(self._write_task)
+        except asyncio.CancelledError:
+            raise  # 写盘结果交由 terminate() 处理
         except Exception as e:
-            # 回滚
-            self.config["group_limits"], self.config["group_total_limits"], self.config["user_limits"] = backup
-            self._reload_config()
-            logger.error(f"[rate_limit] 保存配置失败，已回滚: {e}")
-            raise
+            self._on_save_failed(e)
+        else:
+            self._save_error = None
+        self._write_task = None
+
+    def _on_save_failed(self, e: Exception):
+        """记录保存失败；不回滚内存中的修改。"""
+        self._save_error = str(e)
+        logger.error(f"[rate_limit] 保存配置失败，修改仅在内存中生效，重启后将丢失: {e}")
+
+    async def terminate(self):
+        """插件卸载时等待进行中的写盘，再写入尚未保存的配置。"""
+        task = self._save_task
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        write = self._write_task
+        if write is not None:
+            # 被取消的 _write_config 未处理这次写盘的结果，在此等待线程写完
+            self._write_task = None
+            try:
+                await write
+            except Exception as e:
+                self._on_save_failed(e)
+            else:
+                self._save_error = None
+        if self._save_pending:
+            await self._write_config()
+        if self._redis is not None:
+            # aclose() 自 redis-py 5.0.1 起提供，旧版本使用 close()
+            close = getattr(self._redis, "aclose", None) or self._redis.close
+            await close()
 
     # ─── 核心逻辑 ────────────────────────────────────────────────
 
-    def _resolve_max_requests(self, user_id: str, group_id: str | None) -> int:
-        """根据优先级解析该用户的最大请求数。
+    def _resolve_max_requests(self, user_id: str, group_id: str | None) -> int | None:
+        """根据优先级解析该用户的最大请求数，白名单用户返回 None。
 
-        优先级: 用户自定义 > 群组自定义 > 全局默认
+        优先级: 白名单 > 用户自定义 > 群组自定义 > 全局默认
+        与 _build_checker() 共用 _user_policy，一次查询同时得到白名单与用户自定义限制。
         """
-        if user_id in self.user_limits:
-            return self.user_limits[user_id]
-        if group_id and group_id in self.group_limits:
-            return self.group_limits[group_id]
-        return self.max_requests
+        max_req = self._user_policy.get(user_id, _MISSING)
+        if max_req is _MISSING:
+            if group_id:
+                return self.group_limits.get(group_id, self.max_requests)
+            return self.max_requests
+        return max_req
 
-    def _resolve_group_total(self, group_id: str) -> int:
-        """解析群组的总量限制。
+    @staticmethod
+    def _window_check(records: _SlidingWindow | _TokenBucket | None, max_req: int,
+                      window_ms: int, now: int) -> tuple[bool, float]:
+        """通用限流检查（不记录，仅判断 + 返回冷却秒数）。
 
-        优先级: 群组自定义总量 > 全局默认群总量
-        返回 0 表示不限制。
+        records 为 None 表示尚无任何记录，直接放行。
+        时间均为整数毫秒，仅在拒绝路径上换算回秒。
         """
-        if group_id in self.group_total_limits:
-            return self.group_total_limits[group_id]
-        return self.default_group_total
-
-    @staticmethod
-    def _sliding_window_check(records: deque, max_req: int, time_window: int,
-                              now: float) -> tuple[bool, float]:
-        """通用滑动窗口检查（不记录，仅判断 + 返回冷却时间）。"""
         if max_req <= 0:
             return False, 0.0
-        window_start = now - time_window
-        while records and records[0] <= window_start:
-            records.popleft()
-        if len(records) >= max_req:
-            cooldown = records[0] - window_start
-            return False, round(cooldown, 1)
+        if records is None:
+            return True, 0.0
+        cooldown_ms = records.check(max_req, window_ms, now)
+        if cooldown_ms:
+            return False, _cooldown_seconds(cooldown_ms)
         return True, 0.0
 
+    def _window_for(self, d: OrderedDict[str, _SlidingWindow | _TokenBucket],
+                    key: str) -> _SlidingWindow | _TokenBucket:
+        """取出 key 的限流状态，不存在时创建。只用于即将记录的路径。
+
+        命中时将 key 移到表尾，表头始终是最久未记录的 key；
+        表满 _MAX_TRACKED 时从表头淘汰（LRU），持续活跃的用户不会被挤掉，
+        保证大量一次性用户涌入时内存仍有上限。
+        """
+        records = d.get(key)
+        if records is not None:
+            d.move_to_end(key)
+            return records
+        if len(d) >= self._MAX_TRACKED:
+            d.popitem(last=False)
+            self._evicted += 1
+            if self._evicted == 1:
+                logger.warning(f"[rate_limit] 跟踪的 key 数达到上限 {self._MAX_TRACKED}，开始淘汰最久未活跃的记录")
+        records = d[key] = self._window_cls()
+        return records
+
+    def _window_used(self, records: _SlidingWindow | _TokenBucket | None,
+                     max_req: int, now: int) -> int:
+        """窗口内已用次数（仅用于展示）。"""
+        if records is None:
+            return 0
+        return records.used(max_req, self._time_window_ms, now)
+
     @staticmethod
-    def _sliding_window_record(records: deque, now: float):
-        """记录一次请求时间戳。"""
-        records.append(now)
+    def _window_check_and_record(records: _SlidingWindow | _TokenBucket, max_req: int,
+                                 window_ms: int, now: int) -> tuple[bool, float]:
+        """检查并在允许时立即记录，用于无需等待其他检查结果的场景。"""
+        if max_req <= 0:
+            return False, 0.0
+        cooldown_ms = records.check(max_req, window_ms, now)
+        if cooldown_ms:
+            return False, _cooldown_seconds(cooldown_ms)
+        records.record(now, max_req)
+        return True, 0.0
 
-    def _maybe_auto_cleanup(self, now: float):
+    def _maybe_auto_cleanup(self, now: int, force: bool = False):
         """定期自动清理过期记录和空 key，防止内存膨胀。
 
-        使用游标轮转 + 批量限制，确保所有 key 在多轮内都能被覆盖。
-        空 key 在遍历中即时删除，避免额外全量扫描。
+        按时间间隔触发，或由 force 在累计请求数达到阈值时触发。
+        状态表按最近记录排序，过期的 key 集中在表头，
+        每轮只从表头取出最多 _CLEANUP_BATCH 个 key 检查，不复制整张表。
+        窗口内已无有效请求的 key 直接删除。
         """
-        if now - self._last_cleanup < self._CLEANUP_INTERVAL:
+        if not force and now - self._last_cleanup < self._CLEANUP_INTERVAL * 1000:
             return
         self._last_cleanup = now
-        window_start = now - self.time_window
+        self._sweep_counter = 0
+        window_start = now - self._time_window_ms
         budget = self._CLEANUP_BATCH
 
         for d in (self._request_records, self._group_records):
-            keys = list(d.keys())
-            if not keys:
-                continue
-            total = len(keys)
-            start = self._cleanup_cursor % total if total else 0
-            # 从游标位置开始轮转遍历
-            indices = list(range(start, total)) + list(range(0, start))
-            to_delete = []
-            for idx in indices[:budget]:
-                k = keys[idx]
-                records = d[k]
-                while records and records[0] <= window_start:
-                    records.popleft()
-                if not records:
-                    to_delete.append(k)
-            for k in to_delete:
-                del d[k]
-            budget -= min(budget, len(indices))
+            batch = list(islice(d.items(), budget))
+            for k, records in batch:
+                if records.expired(window_start):
+                    del d[k]
+            budget -= len(batch)
             if budget <= 0:
                 break
 
-        self._cleanup_cursor += self._CLEANUP_BATCH
-
     # ─── Hook: LLM 请求前拦截 ────────────────────────────────────
 
-    @filter.on_llm_request()
-    async def on_llm_request(self, event: AstrMessageEvent, request: ProviderRequest):
-        """在 LLM 请求发送前检查频率限制。
+    def _build_checker(self):
+        """按当前配置生成专用的限流检查函数 check(user_id, event) -> 提示 | None。
+
+        开关、窗口长度、默认限制和提示模板在两次配置变更之间不变，
+        预先绑定为闭包变量，热路径上不再逐次读取实例属性和判断开关。
+        由 _on_limits_changed() 在配置或限制变更时重建。
 
         检查顺序:
         1. 白名单 → 跳过所有检查
         2. 用户级频率限制（用户自定义 > 群组自定义 > 全局默认）
         3. 群组总量限制（群内所有用户共享计数器）
-        两个检查都通过后才记录请求。
+        两个检查都通过后才记录请求；不涉及群总量时用户级检查与记录一步完成。
         """
-        user_id = str(event.get_sender_id())
+        if not self._any_limit_enabled:
+            return lambda user_id, event: None
+
+        user_policy_get = self._user_policy.get
+        enable_user = self.enable_user_limit
+        enable_group = self._group_total_active
+        need_group_id = self._need_group_id
+        group_limits_get = self.group_limits.get if self.group_limits else None
+        group_total_get = self.group_total_limits.get
+        default_group_total = self.default_group_total
+        max_requests = self.max_requests
+        time_window = self.time_window
+        window_ms = self._time_window_ms
+        user_table = self._request_records
+        group_table = self._group_records
+        window_for = self._window_for
+        window_check = self._window_check
+        check_and_record = self._window_check_and_record
+        render_tip = self._render_tip
+        render_group_tip = self._render_group_tip
+        sweep_every = self._SWEEP_EVERY
+        now_ms = _now_ms
+
+        def check(user_id: str, event: AstrMessageEvent) -> str | None:
+            # 一次查询同时得到白名单与用户自定义限制
+            policy = user_policy_get(user_id, _MISSING)
+            if policy is None:  # 白名单用户跳过所有检查
+                return None
+
+            now = now_ms()
+            group_id = event.get_group_id() if need_group_id else None
+            if group_id is not None:
+                group_id = str(group_id)
+
+            # 定期自动清理过期记录（按时间或按请求数触发）
+            self._sweep_counter += 1
+            self._maybe_auto_cleanup(now, force=self._sweep_counter >= sweep_every)
+
+            group_max = group_total_get(group_id, default_group_total) if enable_group and group_id else 0
+
+            # ── 检查 1: 用户级频率 ──
+            user_records = None
+            record_user = False
+            if enable_user:
+                # 优先级: 用户自定义 > 群组自定义 > 全局默认
+                if policy is not _MISSING:
+                    max_req = policy
+                elif group_id and group_limits_get is not None:
+                    max_req = group_limits_get(group_id, max_requests)
+                else:
+                    max_req = max_requests
+                if group_max > 0:
+                    # 需等群总量检查通过后再记录；尚无记录时不创建状态
+                    user_records = user_table.get(user_id)
+                    allowed, cooldown = window_check(user_records, max_req, window_ms, now)
+                    record_user = True
+                else:
+                    allowed, cooldown = check_and_record(
+                        window_for(user_table, user_id), max_req, window_ms, now
+                    )
+                if not allowed:
+                    return render_tip(_TipVars(cooldown=cooldown, max=max_req, window=time_window))
+
+            # ── 检查 2: 群组总量（通过即记录） ──
+            if group_max > 0:
+                g_allowed, g_cooldown = check_and_record(
+                    window_for(group_table, group_id), group_max, window_ms, now
+                )
+                if not g_allowed:
+                    return render_group_tip(
+                        _TipVars(cooldown=g_cooldown, max=group_max, window=time_window)
+                    )
+                # ── 两项检查都通过，补记用户级请求 ──
+                if record_user:
+                    # 经 window_for 取出，保持状态表按最近记录排序
+                    window_for(user_table, user_id).record(now, max_req)
+            return None
 
-        # 白名单用户跳过所有检查
-        if user_id in self.whitelist:
-            return
+        return check
+
+    async def _redis_check(self, user_id: str, event: AstrMessageEvent) -> str | None:
+        """使用 Redis 共享状态检查限流，规则与 _build_checker() 相同。
 
-        now = time.monotonic()
-        group_id = event.get_group_id()
+        Redis 出错时记录一次警告，并在 _REDIS_BACKOFF 秒内退回内存检查。
+        """
+        if not self._any_limit_enabled:
+            return None
+        group_id = event.get_group_id() if self._need_group_id else None
         if group_id is not None:
             group_id = str(group_id)
-
-        # 定期自动清理过期记录
-        self._maybe_auto_cleanup(now)
-
-        # ── 检查 1: 用户级频率 ──
-        if self.enable_user_limit:
-            max_req = self._resolve_max_requests(user_id, group_id)
-            user_records = self._request_records[user_id]
-            allowed, cooldown = self._sliding_window_check(
-                user_records, max_req, self.time_window, now
-            )
-            if not allowed:
-                event.stop_event()
-                try:
-                    tip = self.tip_message.format(
-                        cooldown=cooldown, max=max_req, window=self.time_window
-                    )
-                except (KeyError, ValueError, IndexError):
-                    tip = f"⚠️ 请求过于频繁，请稍后再试。"
-                try:
-                    await event.send(tip)
-                except Exception:
-                    logger.warning(f"[rate_limit] 发送用户限流提示失败: user={user_id}")
-                return
-
-        # ── 检查 2: 群组总量 ──
+        max_req = self._resolve_max_requests(user_id, group_id)
+        if max_req is None:  # 白名单用户跳过所有检查
+            return None
+        if not self.enable_user_limit:
+            max_req = 0
         group_max = 0
-        if self.enable_group_total_limit and group_id:
-            group_max = self._resolve_group_total(group_id)
-        if group_id and group_max > 0:
-            group_records = self._group_records[group_id]
-            g_allowed, g_cooldown = self._sliding_window_check(
-                group_records, group_max, self.time_window, now
+        if self._group_total_active and group_id:
+            group_max = self.group_total_limits.get(group_id, self.default_group_total)
+        if max_req <= 0 and group_max <= 0:
+            return None
+        try:
+            kind, cooldown_ms = await self._redis_script(
+                keys=[f"{_REDIS_PREFIX}:u:{user_id}", f"{_REDIS_PREFIX}:g:{group_id or ''}"],
+                args=[self._time_window_ms, max_req, group_max, uuid.uuid4().hex],
             )
-            if not g_allowed:
-                event.stop_event()
-                try:
-                    tip = self.group_tip_message.format(
-                        cooldown=g_cooldown, max=group_max, window=self.time_window
-                    )
-                except (KeyError, ValueError, IndexError):
-                    tip = f"⚠️ 本群请求过于频繁，请稍后再试。"
-                try:
-                    await event.send(tip)
-                except Exception:
-                    logger.warning(f"[rate_limit] 发送群总量限流提示失败: group={group_id}")
-                return
-
-        # ── 两项检查都通过，记录请求 ──
-        if self.enable_user_limit:
-            self._sliding_window_record(self._request_records[user_id], now)
-        if group_id and group_max > 0:
-            self._sliding_window_record(self._group_records[group_id], now)
+        except Exception as e:
+            now = _now_ms()
+            if now >= self._redis_retry_at:  # 并发请求同时失败时只记录一次
+                logger.warning(f"[rate_limit] Redis 限流检查失败，{self._REDIS_BACKOFF} 秒内退回内存检查: {e}")
+            self._redis_retry_at = now + self._REDIS_BACKOFF * 1000
+            return self._check_fn(user_id, event)
+        if self._redis_retry_at:
+            self._redis_retry_at = 0
+            logger.info("[rate_limit] Redis 已恢复，继续使用共享限流计数")
+        if kind == 0:
+            return None
+        cooldown = _cooldown_seconds(int(cooldown_ms))
+        if kind == 1:
+            return self._render_tip(_TipVars(cooldown=cooldown, max=max_req, window=self.time_window))
+        return self._render_group_tip(_TipVars(cooldown=cooldown, max=group_max, window=self.time_window))
+
+    @filter.on_llm_request()
+    async def on_llm_request(self, event: AstrMessageEvent, request: ProviderRequest):
+        """在 LLM 请求发送前检查频率限制，超限时拦截并发送提示。
+
+        具体检查逻辑见 _build_checker()；配置了 Redis 且未处于出错退避期时由 _redis_check() 处理。
+        """
+        user_id = str(event.get_sender_id())
+        if self._redis_script is not None and _now_ms() >= self._redis_retry_at:
+            tip = await self._redis_check(user_id, event)
+        else:
+            tip = self._check_fn(user_id, event)
+        if tip is None:
+            return
+        event.stop_event()
+        try:
+            await event.send(tip)
+        except Exception:
+            logger.warning(f"[rate_limit] 发送限流提示失败: user={user_id}")
 
     # ─── 管理指令组 /rl ──────────────────────────────────────────
 
@@ -283,15 +672,20 @@ class RateLimitPlugin(Star):
     @filter.permission_type(PermissionType.ADMIN)
     async def rl_status(self, event: AstrMessageEvent):
         """查看当前频率限制状态。"""
+        now = _now_ms()
         # 复用定时清理逻辑
-        self._maybe_auto_cleanup(time.monotonic())
+        self._maybe_auto_cleanup(now)
         active_users = len(self._request_records)
         active_groups = len(self._group_records)
         gt_default = f"{self.default_group_total} 次" if self.default_group_total > 0 else "不限制"
         ul_status = "✅ 开启" if self.enable_user_limit else "❌ 关闭"
         gl_status = "✅ 开启" if self.enable_group_total_limit else "❌ 关闭"
+        algo = "令牌桶" if self.algorithm == "token_bucket" else "滑动窗口"
+        if self._redis is not None:
+            algo = "滑动窗口（Redis 共享）"
         lines = [
             "📊 LLM 频率限制状态",
+            f"├ 限流算法: {algo}",
             f"├ 个人限制: {ul_status}",
             f"├ 群总量限制: {gl_status}",
             f"├ 全局每用户默认: {self.max_requests} 次/{self.time_window} 秒",
@@ -301,8 +695,11 @@ class RateLimitPlugin(Star):
             f"├ 用户自定义: {len(self.user_limits)} 个",
             f"├ 白名单人数: {len(self.whitelist)}",
             f"├ 当前活跃用户数: {active_users}",
-            f"└ 当前活跃群组数: {active_groups}",
+            f"├ 当前活跃群组数: {active_groups}",
+            f"└ 超出容量淘汰次数: {self._evicted}",
         ]
+        if self._save_error is not None:
+            lines.append(f"  ⚠️ 上次保存配置失败，修改仅在内存中生效，重启后将丢失: {self._save_error}")
         if self.group_limits:
             lines.append("  📁 群组每用户限制:")
             items = list(self.group_limits.items())
@@ -314,8 +711,7 @@ class RateLimitPlugin(Star):
             lines.append("  🏢 群组总量限制:")
             items = list(self.group_total_limits.items())
             for gid, limit in items[:self._MAX_DISPLAY]:
-                grp_records = self._group_records.get(gid)
-                used = len(grp_records) if grp_records else 0
+                used = self._window_used(self._group_records.get(gid), limit, now)
                 lines.append(f"    · {gid}: {limit} 次（已用 {used}）")
             if len(items) > self._MAX_DISPLAY:
                 lines.append(f"    ... 省略 {len(items) - self._MAX_DISPLAY} 条")
@@ -342,13 +738,9 @@ class RateLimitPlugin(Star):
             yield event.plain_result(f"ℹ️ 用户 {user_id} 已在白名单中。")
             return
         self.whitelist.add(user_id)
-        self.config["whitelist"] = list(self.whitelist)
-        try:
-            self.config.save_config()
-        except Exception:
-            self.whitelist.discard(user_id)
-            yield event.plain_result("❌ 保存配置失败。")
-            return
+        self._on_limits_changed()
+        self.config["whitelist"] = sorted(self.whitelist)
+        self._schedule_save()
         yield event.plain_result(f"✅ 已将用户 {user_id} 添加到白名单。")
 
     @rl_group.command("wl_del")
@@ -360,13 +752,9 @@ class RateLimitPlugin(Star):
             yield event.plain_result(f"ℹ️ 用户 {user_id} 不在白名单中。")
             return
         self.whitelist.discard(user_id)
-        self.config["whitelist"] = list(self.whitelist)
-        try:
-            self.config.save_config()
-        except Exception:
-            self.whitelist.add(user_id)
-            yield event.plain_result("❌ 保存配置失败。")
-            return
+        self._on_limits_changed()
+        self.config["whitelist"] = sorted(self.whitelist)
+        self._schedule_save()
         self._request_records.pop(user_id, None)
         yield event.plain_result(f"✅ 已将用户 {user_id} 从白名单移除。")
 
@@ -395,8 +783,9 @@ class RateLimitPlugin(Star):
             yield event.plain_result("❌ 最大请求次数必须 ≥ 1。")
             return
         self.max_requests = count
+        self._on_limits_changed()
         self.config["max_requests"] = count
-        self.config.save_config()
+        self._schedule_save()
         yield event.plain_result(f"✅ 全局最大请求次数已设置为 {count} 次/{self.time_window} 秒。")
 
     @rl_group.command("set_window")
@@ -407,8 +796,10 @@ class RateLimitPlugin(Star):
             yield event.plain_result("❌ 时间窗口必须 ≥ 1 秒。")
             return
         self.time_window = seconds
+        self._time_window_ms = seconds * 1000
+        self._on_limits_changed()
         self.config["time_window_seconds"] = seconds
-        self.config.save_config()
+        self._schedule_save()
         self._request_records.clear()
         self._group_records.clear()
         yield event.plain_result(f"✅ 时间窗口已设置为 {seconds} 秒（已重置所有计数器）。")
@@ -421,8 +812,9 @@ class RateLimitPlugin(Star):
             yield event.plain_result("❌ 总次数必须 ≥ 0。")
             return
         self.default_group_total = count
+        self._on_limits_changed()
         self.config["default_group_total"] = count
-        self.config.save_config()
+        self._schedule_save()
         if count == 0:
             yield event.plain_result("✅ 已关闭全局默认群总量限制。")
         else:
@@ -444,12 +836,8 @@ class RateLimitPlugin(Star):
             yield event.plain_result("❌ 最大请求次数必须 ≥ 1。")
             return
         self.group_limits[group_id] = count
-        try:
-            self._save_limits()
-        except Exception:
-            self.group_limits.pop(group_id, None)
-            yield event.plain_result("❌ 保存配置失败。")
-            return
+        self._on_limits_changed()
+        self._save_limits()
         yield event.plain_result(f"✅ 群组 {group_id} 的每用户限制已设置为 {count} 次/{self.time_window} 秒。")
 
     @rl_group.command("group_del")
@@ -460,6 +848,7 @@ class RateLimitPlugin(Star):
             yield event.plain_result(f"ℹ️ 群组 {group_id} 没有每用户自定义限制。")
             return
         del self.group_limits[group_id]
+        self._on_limits_changed()
         self._save_limits()
         yield event.plain_result(f"✅ 已移除群组 {group_id} 的每用户限制，恢复全局默认 ({self.max_requests} 次)。")
 
@@ -492,12 +881,8 @@ class RateLimitPlugin(Star):
             yield event.plain_result("❌ 总次数必须 ≥ 1。")
             return
         self.group_total_limits[group_id] = count
-        try:
-            self._save_limits()
-        except Exception:
-            self.group_total_limits.pop(group_id, None)
-            yield event.plain_result("❌ 保存配置失败。")
-            return
+        self._on_limits_changed()
+        self._save_limits()
         yield event.plain_result(
             f"✅ 群组 {group_id} 的总量限制已设置为 {count} 次/{self.time_window} 秒（全群共享）。"
         )
@@ -510,6 +895,7 @@ class RateLimitPlugin(Star):
             yield event.plain_result(f"ℹ️ 群组 {group_id} 没有总量限制。")
             return
         del self.group_total_limits[group_id]
+        self._on_limits_changed()
         self._save_limits()
         self._group_records.pop(group_id, None)
         yield event.plain_result(f"✅ 已移除群组 {group_id} 的总量限制。")
@@ -522,10 +908,10 @@ class RateLimitPlugin(Star):
             yield event.plain_result("🏢 没有群组总量限制。")
             return
         lines = ["🏢 群组总量限制:"]
+        now = _now_ms()
         items = list(self.group_total_limits.items())
         for gid, limit in items[:self._MAX_DISPLAY]:
-            grp_records = self._group_records.get(gid)
-            used = len(grp_records) if grp_records else 0
+            used = self._window_used(self._group_records.get(gid), limit, now)
             lines.append(f"  · {gid}: {limit} 次/{self.time_window} 秒（已用 {used}）")
         if len(items) > self._MAX_DISPLAY:
             lines.append(f"  ... 省略 {len(items) - self._MAX_DISPLAY} 条")
@@ -545,12 +931,8 @@ class RateLimitPlugin(Star):
             yield event.plain_result("❌ 最大请求次数必须 ≥ 1。")
             return
         self.user_limits[user_id] = count
-        try:
-            self._save_limits()
-        except Exception:
-            self.user_limits.pop(user_id, None)
-            yield event.plain_result("❌ 保存配置失败。")
-            return
+        self._on_limits_changed()
+        self._save_limits()
         self._request_records.pop(user_id, None)
         yield event.plain_result(f"✅ 用户 {user_id} 的频率限制已设置为 {count} 次/{self.time_window} 秒。")
 
@@ -562,6 +944,7 @@ class RateLimitPlugin(Star):
             yield event.plain_result(f"ℹ️ 用户 {user_id} 没有自定义限制。")
             return
         del self.user_limits[user_id]
+        self._on_limits_changed()
         self._save_limits()
         yield event.plain_result(f"✅ 已移除用户 {user_id} 的自定义限制。")
 
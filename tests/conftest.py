@@ -0,0 +1,60 @@
+import logging
+import sys
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _install_astrbot_stub():
+    """未安装 AstrBot 时注入最小的 astrbot.api 替身，仅满足 main.py 的导入与装饰器。"""
+
+    class AstrBotConfig(dict):
+        def save_config(self):
+            pass
+
+    class _CommandGroup:
+        def __init__(self, fn):
+            self.fn = fn
+
+        def command(self, name):
+            return lambda fn: fn
+
+    class _Filter:
+        def on_llm_request(self):
+            return lambda fn: fn
+
+        def command_group(self, name):
+            return _CommandGroup
+
+        def permission_type(self, perm):
+            return lambda fn: fn
+
+    class AstrMessageEvent:
+        pass
+
+    class PermissionType:
+        ADMIN = "admin"
+
+    class Star:
+        def __init__(self, context):
+            self.context = context
+
+    modules = {
+        "astrbot": {},
+        "astrbot.api": {"AstrBotConfig": AstrBotConfig, "logger": logging.getLogger("astrbot")},
+        "astrbot.api.event": {"filter": _Filter(), "AstrMessageEvent": AstrMessageEvent},
+        "astrbot.api.event.filter": {"PermissionType": PermissionType},
+        "astrbot.api.star": {"Context": object, "Star": Star},
+        "astrbot.api.provider": {"ProviderRequest": object},
+    }
+    for name, attrs in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+
+
+try:
+    import astrbot.api  # noqa: F401
+except ImportError:
+    _install_astrbot_stub()
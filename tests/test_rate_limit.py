@@ -0,0 +1,229 @@
+import asyncio
+import threading
+import types
+
+import pytest
+
+import main
+
+
+class FakeEvent:
+    def __init__(self, user_id, group_id=None):
+        self.user_id = user_id
+        self.group_id = group_id
+        self.sent = []
+        self.stopped = False
+
+    def get_sender_id(self):
+        return self.user_id
+
+    def get_group_id(self):
+        return self.group_id
+
+    def stop_event(self):
+        self.stopped = True
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+class FakeConfig(dict):
+    def save_config(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def frozen_clock(monkeypatch):
+    """固定时钟，避免令牌桶在两次请求之间补充令牌导致结果抖动。"""
+    monkeypatch.setattr(main, "_now_ms", lambda: 1_000_000)
+
+
+def make_plugin(**config):
+    return main.RateLimitPlugin(None, FakeConfig(**config))
+
+
+def request(plugin, user_id, group_id=None):
+    """发起一次 LLM 请求，返回是否被拦截。"""
+    event = FakeEvent(user_id, group_id)
+    asyncio.run(plugin.on_llm_request(event, None))
+    return event.stopped
+
+
+@pytest.mark.parametrize("algorithm", ["sliding_window", "token_bucket"])
+def test_user_limit(algorithm):
+    plugin = make_plugin(algorithm=algorithm, max_requests=2, time_window_seconds=60)
+    assert request(plugin, "u") is False
+    assert request(plugin, "u") is False
+    assert request(plugin, "u") is True
+    assert request(plugin, "v") is False
+
+
+@pytest.mark.parametrize("algorithm", ["sliding_window", "token_bucket"])
+def test_first_request_with_group_total(algorithm):
+    plugin = make_plugin(algorithm=algorithm, max_requests=2, time_window_seconds=60,
+                         default_group_total=3)
+    assert request(plugin, "u", "G") is False
+    assert plugin._request_records["u"].used(2, 60_000, main._now_ms()) == 1
+    assert plugin._group_records["G"].used(3, 60_000, main._now_ms()) == 1
+    assert request(plugin, "u", "G") is False
+    assert request(plugin, "u", "G") is True   # 用户级超限
+    assert request(plugin, "v", "G") is False
+    assert request(plugin, "w", "G") is True   # 群总量超限
+
+
+def test_token_bucket_record_without_check():
+    bucket = main._TokenBucket()
+    bucket.record(1000, 3)
+    assert bucket.tokens == 2.0
+    assert not bucket.expired(0)
+
+
+def test_rejected_by_group_does_not_count_for_user():
+    plugin = make_plugin(max_requests=2, time_window_seconds=60, default_group_total=1)
+    assert request(plugin, "b", "G") is False
+    assert request(plugin, "a", "G") is True    # 群总量已满，不计入 a 的用户级次数
+    assert request(plugin, "a", "H") is False
+    assert request(plugin, "a") is False
+    assert request(plugin, "a") is True
+
+
+def test_whitelist_wins_over_user_limit():
+    plugin = make_plugin(max_requests=1, time_window_seconds=60,
+                         whitelist=["u"], user_limits={"u": 1})
+    for _ in range(5):
+        assert request(plugin, "u") is False
+
+
+def test_eviction_keeps_recently_active_users(monkeypatch):
+    monkeypatch.setattr(main.RateLimitPlugin, "_MAX_TRACKED", 3)
+    plugin = make_plugin(max_requests=100, time_window_seconds=60)
+    request(plugin, "active")
+    for i in range(10):
+        request(plugin, f"once{i}")
+        request(plugin, "active")
+    assert "active" in plugin._request_records
+    assert len(plugin._request_records) == 3
+    assert plugin._evicted == 8
+
+
+def test_cleanup_drops_expired_keys_from_the_front():
+    plugin = make_plugin(max_requests=5, time_window_seconds=60)
+    for i in range(plugin._CLEANUP_BATCH + 10):
+        request(plugin, f"old{i}")
+    later = main._now_ms() + 61_000
+    plugin._window_for(plugin._request_records, "new").record(later, 5)
+    plugin._maybe_auto_cleanup(later, force=True)
+    assert len(plugin._request_records) == 11
+    plugin._maybe_auto_cleanup(later, force=True)
+    assert list(plugin._request_records) == ["new"]
+
+
+def test_redis_failure_backs_off_to_memory():
+    plugin = make_plugin(max_requests=1, time_window_seconds=60)
+    calls = []
+
+    async def broken_script(keys, args):
+        calls.append(keys)
+        raise ConnectionError("redis down")
+
+    plugin._redis_script = broken_script
+    assert request(plugin, "u") is False
+    assert request(plugin, "u") is True   # 退避期内直接走内存检查
+    assert len(calls) == 1
+    assert plugin._redis_retry_at == main._now_ms() + plugin._REDIS_BACKOFF * 1000
+
+
+class BlockingConfig(FakeConfig):
+    """写盘会阻塞到 release 被设置的配置，记录并发写入的最大数量。"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.saves = 0
+
+    def save_config(self):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        self.release.wait(timeout=5)
+        with self.lock:
+            self.active -= 1
+            self.saves += 1
+
+
+def test_terminate_waits_for_in_flight_save(monkeypatch):
+    monkeypatch.setattr(main.RateLimitPlugin, "_SAVE_DELAY", 0)
+    config = BlockingConfig()
+    plugin = main.RateLimitPlugin(None, config)
+    write_config = plugin._write_config
+
+    async def run():
+        write_started = asyncio.Event()
+
+        async def patched_write_config():
+            write_started.set()
+            await write_config()
+
+        plugin._write_config = patched_write_config
+        plugin._schedule_save()
+        await write_started.wait()         # 第一次写盘已提交到线程，且被阻塞
+        plugin._schedule_save()            # 写盘期间又有修改
+        terminate = asyncio.create_task(plugin.terminate())
+        for _ in range(3):                 # 让 terminate 运行到等待写盘处
+            await asyncio.sleep(0)
+        config.release.set()
+        await terminate
+
+    asyncio.run(run())
+    assert config.max_active == 1
+    assert config.saves == 2
+
+
+def test_failed_save_is_reported(monkeypatch):
+    monkeypatch.setattr(main.RateLimitPlugin, "_SAVE_DELAY", 0)
+
+    class BrokenConfig(FakeConfig):
+        def save_config(self):
+            raise OSError("disk full")
+
+    plugin = main.RateLimitPlugin(None, BrokenConfig())
+
+    async def run():
+        plugin._schedule_save()
+        await plugin._save_task
+
+    asyncio.run(run())
+    assert plugin._save_error == "disk full"
+
+
+def test_load_limits_legacy_list():
+    raw = ["a:3", "w:+5", "x: 5", "g:1:2", "neg:-1", "zero:0", "bad:x", ":4", "nocolon"]
+    assert main._load_limits(raw) == {"a": 3, "w": 5, "x": 5, "g:1": 2}
+
+
+def test_redis_fallback_uses_sliding_window(monkeypatch):
+    class FakeRedis:
+        closed = False
+
+        @classmethod
+        def from_url(cls, url, **kwargs):
+            return cls()
+
+        def register_script(self, script):
+            async def broken_script(keys, args):
+                raise ConnectionError("redis down")
+            return broken_script
+
+        async def close(self):  # redis-py < 5.0.1 没有 aclose()
+            FakeRedis.closed = True
+
+    monkeypatch.setattr(main, "aioredis", types.SimpleNamespace(Redis=FakeRedis))
+    plugin = make_plugin(algorithm="token_bucket", max_requests=1, redis_url="redis://x")
+    assert plugin._window_cls is main._SlidingWindow
+    assert request(plugin, "u") is False
+    assert isinstance(plugin._request_records["u"], main._SlidingWindow)
+    asyncio.run(plugin.terminate())
+    assert FakeRedis.closed